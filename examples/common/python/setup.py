@@ -128,7 +128,7 @@ setup(
     author = 'Intel',
     url = 'http://www.intel.com',
     packages = find_packages(),
-    install_requires = [],
+    install_requires = ["cryptography>=2.8"],
     ext_modules=[crypto_module, verify_report_module],
     data_files=[],
     entry_points = {})
@@ -0,0 +1,181 @@
+# Copyright 2019 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+_aes_backend.py -- AES-GCM-256 symmetric encryption backend used by utility.py
+
+Uses PyCA cryptography (OpenSSL EVP, AES-NI when the CPU supports it) on
+Python bytes when a release of at least PYCA_MIN_VERSION is installed,
+otherwise falls back to the crypto.SKENC_* functions. Keys and IVs are generated from os.urandom
+in the former case. Both backends produce the same wire format as
+tcf::crypto::skenc: ciphertext followed by the 16 byte GCM tag, with the
+12 byte IV prepended when no IV is given.
+Set TCF_DISABLE_AESNI=1 to force the crypto.SKENC_* path.
+"""
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cryptography
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    cryptography = None
+    AESGCM = None
+
+# Oldest PyCA cryptography release supported, as declared in setup.py,
+# PREREQUISITES.md and the docker image
+PYCA_MIN_VERSION = (2, 8)
+
+# AES-GCM key, IV and tag lengths, same as tcf::crypto::constants
+SYM_KEY_LEN = 32
+IV_LEN = 12
+TAG_LEN = 16
+
+
+# -----------------------------------------------------------------
+def _version_tuple(version):
+    """
+    Returns the leading numeric components of a version string as a tuple
+    """
+    parts = []
+    for part in version.split("."):
+        if not part.isdigit():
+            break
+        parts.append(int(part))
+    return tuple(parts)
+
+
+# Both implementations use OpenSSL EVP and so AES-NI, this only selects
+# PyCA cryptography over the crypto.SKENC_* functions
+USE_PYCA = AESGCM is not None and \
+    _version_tuple(cryptography.__version__) >= PYCA_MIN_VERSION and \
+    os.environ.get("TCF_DISABLE_AESNI", "0") != "1"
+if not USE_PYCA:
+    import crypto.crypto as crypto
+logger.debug("AES-GCM implementation: %s",
+             "PyCA cryptography" if USE_PYCA else "crypto.SKENC")
+
+
+# -----------------------------------------------------------------
+def _check_key_iv(key, iv):
+    if len(key) != SYM_KEY_LEN:
+        raise ValueError("Invalid AES-GCM key length")
+    if iv is not None and len(iv) != IV_LEN:
+        raise ValueError("Invalid AES-GCM IV length")
+
+
+# -----------------------------------------------------------------
+def generate_key():
+    """
+    Generate a random AES-GCM-256 key
+    """
+    if not USE_PYCA:
+        return crypto.SKENC_GenerateKey()
+    return AESGCM.generate_key(bit_length=SYM_KEY_LEN * 8)
+
+
+# -----------------------------------------------------------------
+def generate_iv():
+    """
+    Generate a random AES-GCM IV
+    """
+    if not USE_PYCA:
+        return crypto.SKENC_GenerateIV()
+    return os.urandom(IV_LEN)
+
+
+# -----------------------------------------------------------------
+def encrypt_message(key, message, iv=None):
+    """
+    Encrypt message with AES-GCM-256.
+    If iv is None a random IV is generated and prepended to the result.
+    """
+    return make_encryptor(key, iv)(message)
+
+
+# -----------------------------------------------------------------
+def make_encryptor(key, iv=None):
+    """
+    Returns a function encrypting messages with key and iv, so that a
+    batch of messages sharing the same key is encrypted with a single
+    key setup. Semantics are the same as encrypt_message, in particular
+    a new random IV is generated for every message if iv is None.
+    """
+    if not USE_PYCA:
+        if iv is not None:
+            return lambda message: crypto.SKENC_EncryptMessage(key, iv, message)
+        return lambda message: crypto.SKENC_EncryptMessage(key, message)
+    key = bytes(key)
+    if iv is not None:
+        iv = bytes(iv)
+    _check_key_iv(key, iv)
+    aesgcm = AESGCM(key)
+    if iv is None:
+        def encrypt(message):
+            msg_iv = os.urandom(IV_LEN)
+            return msg_iv + aesgcm.encrypt(msg_iv, bytes(message), None)
+    else:
+        def encrypt(message):
+            return aesgcm.encrypt(iv, bytes(message), None)
+    return encrypt
+
+
+# -----------------------------------------------------------------
+def decrypt_message(key, message, iv=None):
+    """
+    Decrypt message with AES-GCM-256.
+    If iv is None the IV is expected to be prepended to message.
+    Raises ValueError if message authentication fails.
+    """
+    return make_decryptor(key, iv)(message)
+
+
+# -----------------------------------------------------------------
+def make_decryptor(key, iv=None):
+    """
+    Returns a function decrypting messages with key and iv, so that a
+    batch of messages sharing the same key is decrypted with a single
+    key setup. Semantics are the same as decrypt_message.
+    """
+    if not USE_PYCA:
+        if iv is not None:
+            return lambda message: crypto.SKENC_DecryptMessage(key, iv, message)
+        return lambda message: crypto.SKENC_DecryptMessage(key, message)
+    key = bytes(key)
+    if iv is not None:
+        iv = bytes(iv)
+    _check_key_iv(key, iv)
+    aesgcm = AESGCM(key)
+
+    min_len = TAG_LEN if iv is not None else IV_LEN + TAG_LEN
+
+    def decrypt(message):
+        # cryptography releases before 41 only accept bytes, not other
+        # buffers. bytes() does not copy a bytes message, such as the
+        # output of base64.b64decode.
+        message = bytes(message)
+        if len(message) < min_len:
+            raise ValueError("AES-GCM message too short")
+        if iv is None:
+            msg_iv, message = message[:IV_LEN], message[IV_LEN:]
+        else:
+            msg_iv = iv
+        try:
+            return aesgcm.decrypt(msg_iv, message, None)
+        except InvalidTag:
+            raise ValueError("AES-GCM message authentication failed")
+    return decrypt
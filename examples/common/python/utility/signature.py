@@ -98,20 +98,24 @@ class ClientSignature(object):
         input_json_params['inData'] = indata_objects
         logger.info("Encrypting Workorder Data")
 
+        session_encrypt = utility.make_encryptor(session_key, session_iv)
+        data_encrypt = None
         i = 0
         for item in indata_objects:
             data = item['data'].encode('UTF-8')
             e_key = item['encryptedDataEncryptionKey'].encode('UTF-8')
 
             if (not e_key) or (e_key == "null".encode('UTF-8')):
-                enc_data = utility.encrypt_data(data, session_key, session_iv)
+                enc_data = session_encrypt(data)
                 input_json_params['inData'][i]['data'] = crypto.byte_array_to_base64(enc_data)
                 logger.debug("encrypted indata - %s", crypto.byte_array_to_base64(enc_data))
             elif e_key == "-".encode('UTF-8'):
                 # Skip encryption and just encode workorder data to base64 format
                 input_json_params['inData'][i]['data'] = crypto.byte_array_to_base64(data)
             else:
-                enc_data = utility.encrypt_data(data, data_key, data_iv)
+                if data_encrypt is None:
+                    data_encrypt = utility.make_encryptor(data_key, data_iv)
+                enc_data = data_encrypt(data)
                 input_json_params['inData'][i]['data'] = crypto.byte_array_to_base64(enc_data)
                 logger.debug("encrypted indata - %s", crypto.byte_array_to_base64(enc_data))
             i = i + 1
@@ -16,18 +16,30 @@
 utility.py -- general helper function
 """
 import base64
+import codecs
+import hashlib
+import hmac
 import os
-import utility.file_utils as putils
-import utility.hex_utils as hex_utils
-import crypto.crypto as crypto
-import config.config as pconfig
+import re
 import logging
+# crypto.crypto and utility._aes_backend are imported by the functions
+# using them, so that importing this module does not load the crypto
+# extension
 
 logger = logging.getLogger(__name__)
 
 TCFHOME = os.environ.get("TCF_HOME", "../../")
 # No of bytes of encrypted session key to encrypt data
 NO_OF_BYTES = 16
+# Key used for outData items by encryptedDataEncryptionKey value as per
+# TCF API 6.1.7: empty or null means the data is encrypted with the session
+# key, "-" means it is not encrypted, any other value means the data key
+_OUT_DATA_KEY_TYPE = {"": "session", "null": "session", "-": None}
+# PEM public key header and footer
+_PEM_KEY_MARKERS = re.compile("-----(?:BEGIN|END) PUBLIC KEY-----")
+# Power of two exponent of each size unit accepted by human_read_to_byte
+_UNIT_SHIFT = {name: 10 * i for i, name in enumerate(
+    ("B", "KB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB"))}
 
 
 def create_error_response(code, jrpc_id, message):
@@ -38,13 +50,11 @@ def create_error_response(code, jrpc_id, message):
         - jrpc_id: JRPC id of the error response
         - message: error message which corresponds to error response
     """
-    error_response = {}
-    error_response["jsonrpc"] = "2.0"
-    error_response["id"] = jrpc_id
-    error_response["error"] = {}
-    error_response["error"]["code"] = code
-    error_response["error"]["message"] = message
-    return error_response
+    return {
+        "jsonrpc": "2.0",
+        "id": jrpc_id,
+        "error": {"code": code, "message": message},
+    }
 
 
 # -----------------------------------------------------------------------------
@@ -52,9 +62,8 @@ def strip_begin_end_key(key):
     """
     Strips off newline chars, BEGIN PUBLIC KEY and END PUBLIC KEY.
     """
-    return key.replace("\n", "")\
-        .replace("-----BEGIN PUBLIC KEY-----", "").replace(
-        "-----END PUBLIC KEY-----", "")
+    # Newlines are removed first as they may split the markers
+    return _PEM_KEY_MARKERS.sub("", key.replace("\n", ""))
 
 
 # -----------------------------------------------------------------------------
@@ -62,6 +71,7 @@ def generate_signing_keys():
     """
     Function to generate private key object
     """
+    import crypto.crypto as crypto
 
     signing_key = crypto.SIG_PrivateKey()
     signing_key.Generate()
@@ -73,8 +83,9 @@ def generate_iv():
     """
     Function to generate random initialization vector
     """
+    import utility._aes_backend as aes_backend
 
-    return crypto.SKENC_GenerateIV()
+    return aes_backend.generate_iv()
 
 
 # -----------------------------------------------------------------
@@ -85,6 +96,7 @@ def generate_encrypted_key(key, encryption_key):
     - encryption_key is a one-time encryption used to encrypt the passed key
     - key that needs to be encrypted
     """
+    import crypto.crypto as crypto
 
     pub_enc_key = crypto.PKENC_PublicKey(encryption_key)
     return pub_enc_key.EncryptMessage(key)
@@ -95,7 +107,8 @@ def generate_key():
     """
     Function to generate symmetric key
     """
-    return crypto.SKENC_GenerateKey()
+    import utility._aes_backend as aes_backend
+    return aes_backend.generate_key()
 
 
 # -----------------------------------------------------------------
@@ -105,17 +118,40 @@ def list_difference(list_1, list_2):
     Parameters:
     - list_1 / list_2 any list of integers.
     """
-    list_dif = [i for i in list_1 + list_2 if i not in list_2]
+    try:
+        set_2 = set(list_2)
+        list_dif = [i for i in list_1 if i not in set_2]
+    except TypeError:
+        # Unhashable items, fall back to a linear scan of list_2
+        list_dif = [i for i in list_1 if i not in list_2]
     return list_dif
 
 
 # -----------------------------------------------------------------
-def compute_data_hash(data):
+def compute_data_hash(data, chunk=65536):
     '''
     Computes SHA-256 hash of data
+    data is either a string, which is hashed UTF-8 encoded, or a bytes-like
+    object, which is hashed as is without copying.
+    Strings larger than chunk characters are encoded and hashed chunk by
+    chunk, so the whole encoded payload is never held in memory; shorter
+    strings are encoded in one go. chunk must be positive.
+    Uses hashlib, which is backed by OpenSSL and picks the SHA extensions
+    (SHA-NI) implementation when the CPU supports it.
+    Returns the digest as bytes
     '''
-    data_hash = crypto.compute_message_hash(data.encode("UTF-8"))
-    return data_hash
+    if chunk <= 0:
+        raise ValueError("Invalid chunk size")
+    if isinstance(data, str) and len(data) > chunk:
+        data_hash = hashlib.sha256()
+        encoder = codecs.getincrementalencoder("UTF-8")()
+        for start in range(0, len(data), chunk):
+            data_hash.update(encoder.encode(data[start:start + chunk]))
+        data_hash.update(encoder.encode("", final=True))
+        return data_hash.digest()
+    if isinstance(data, str):
+        data = data.encode("UTF-8")
+    return hashlib.sha256(data).digest()
 
 
 # -----------------------------------------------------------------
@@ -130,14 +166,28 @@ def encrypt_data(data, encryption_key, iv=None):
           The default is all zeros.iv must be a unique random number for every
           encryption operation.
     """
+    import utility._aes_backend as aes_backend
     logger.debug("encrypted_session_key: %s", encryption_key)
-    if iv is not None:
-        encrypted_data = crypto.SKENC_EncryptMessage(encryption_key, iv, data)
-    else:
-        encrypted_data = crypto.SKENC_EncryptMessage(encryption_key, data)
+    encrypted_data = aes_backend.encrypt_message(encryption_key, data, iv)
     return encrypted_data
 
 
+# -----------------------------------------------------------------
+def make_encryptor(encryption_key, iv=None):
+    """
+    Function to create an encryptor for bulk encryption of data items
+    sharing the same key and iv
+    Parameters:
+        - encryption_key is the key used to encrypt the data
+        - iv is an initialization vector, same as in encrypt_data
+    Returns a function taking data and returning it encrypted, equivalent
+    to encrypt_data(data, encryption_key, iv)
+    """
+    import utility._aes_backend as aes_backend
+    logger.debug("encrypted_session_key: %s", encryption_key)
+    return aes_backend.make_encryptor(encryption_key, iv)
+
+
 # -----------------------------------------------------------------
 def decrypt_data(encryption_key, data, iv=None):
     """
@@ -150,17 +200,22 @@ def decrypt_data(encryption_key, data, iv=None):
           TCF API 6.1.7 Work Order Data Formats
     Returns decrypted data as a string
     """
+    import utility._aes_backend as aes_backend
     if not data:
         logger.debug("Outdata is empty, nothing to decrypt")
         return data
-    data_byte = crypto.base64_to_byte_array(data)
     logger.debug("encryption_key: %s", encryption_key)
-    if iv is not None:
-        decrypt_result = crypto.SKENC_DecryptMessage(encryption_key,
-                             iv, data_byte)
-    else:
-        decrypt_result = crypto.SKENC_DecryptMessage(encryption_key, data_byte)
-    result = crypto.byte_array_to_string(decrypt_result)
+    return _decrypt_with(aes_backend.make_decryptor(encryption_key, iv), data)
+
+
+def _decrypt_with(decrypt, data):
+    """
+    Decrypts base64 encoded data with a decryptor from
+    aes_backend.make_decryptor and returns it as a string.
+    data must not be empty.
+    """
+    data_byte = base64.b64decode(data)
+    result = bytes(decrypt(data_byte)).decode("UTF-8")
     logger.info("Decryption result at client - %s", result)
     return result
 
@@ -181,34 +236,47 @@ def decrypted_response(input_json, session_key, session_iv, data_key=None, data_
           Default is all zeros.
     returns out data json object in response after decrypting output data
     """
-    input_json_params = input_json['result']
-    i = 0
-    do_decrypt = True
-    data_objects = input_json_params['outData']
+    import utility._aes_backend as aes_backend
+    data_objects = input_json['result']['outData']
+    keys = {
+        "session": (session_key, session_iv),
+        "data": (data_key, data_iv),
+    }
+    # Items are encrypted with either the session key or the data key,
+    # set up each key once and reuse it for all its items
+    decryptors = {}
+    # Identical ciphertexts under the same key have the same plaintext,
+    # decrypt each of them only once
+    decrypted = {}
+    # Loop invariants bound to locals
+    key_type_of = _OUT_DATA_KEY_TYPE.get
+    decrypt_with = _decrypt_with
+    b64decode = base64.b64decode
+    log_plain = logger.isEnabledFor(logging.INFO)
     for item in data_objects:
-        data = item['data'].encode('UTF-8')
-        iv = item['iv'].encode('UTF-8')
-        e_key = item['encryptedDataEncryptionKey'].encode('UTF-8')
-        if not e_key or (e_key == "null".encode('UTF-8')):
-            data_encryption_key_byte = session_key
-            iv = session_iv
-        elif e_key == "-".encode('UTF-8'):
-            do_decrypt = False
+        key_type = key_type_of(item['encryptedDataEncryptionKey'], "data")
+        if key_type is None:
+            data = item['data'].encode('UTF-8')
+            item['data'] = data
+            if log_plain:
+                logger.info("Work order response data not encrypted, data in plain - %s",
+                    b64decode(data).decode('UTF-8'))
+        elif not item['data']:
+            # Checked before the key is set up, the key may be missing
+            logger.debug("Outdata is empty, nothing to decrypt")
         else:
-            data_encryption_key_byte = data_key
-            iv = data_iv
-        if not do_decrypt:
-            input_json_params['outData'][i]['data'] = data
-            logger.info("Work order response data not encrypted, data in plain - %s",
-                base64.b64decode(data).decode('UTF-8'))
-        else:
-            logger.debug("encrypted_key: %s", data_encryption_key_byte)
+            if key_type not in decryptors:
+                data_encryption_key_byte, iv = keys[key_type]
+                logger.debug("encrypted_key: %s", data_encryption_key_byte)
+                decryptors[key_type] = aes_backend.make_decryptor(
+                    data_encryption_key_byte, iv)
             # Decrypt output data
-            data_in_plain = decrypt_data(
-                    data_encryption_key_byte, item['data'], iv)
-            input_json_params['outData'][i]['data'] = data_in_plain
-        i = i + 1
-    return input_json_params['outData']
+            ciphertext = (key_type, item['data'])
+            if ciphertext not in decrypted:
+                decrypted[ciphertext] = decrypt_with(
+                    decryptors[key_type], item['data'])
+            item['data'] = decrypted[ciphertext]
+    return data_objects
 
 
 # -----------------------------------------------------------------------------
@@ -220,10 +288,16 @@ def verify_data_hash(msg, data_hash):
     '''
     verify_success = True
     msg_hash = compute_data_hash(msg)
-    # Convert both hash hex string values to upper case
-    msg_hash_hex = hex_utils.byte_array_to_hex_str(msg_hash).upper()
-    data_hash = data_hash.upper()
-    if msg_hash_hex == data_hash:
+    # Require exactly two hex digits per digest byte, bytes.fromhex alone
+    # would also accept whitespace between the digits
+    data_hash_bytes = b""
+    if len(data_hash) == 2 * len(msg_hash):
+        try:
+            data_hash_bytes = bytes.fromhex(data_hash)
+        except ValueError:
+            pass
+    # Constant time comparison of the raw digests
+    if hmac.compare_digest(msg_hash, data_hash_bytes):
         logger.info("Computed hash of message matched with data hash")
     else:
         logger.error("Computed hash of message does not match with data hash")
@@ -233,14 +307,11 @@ def verify_data_hash(msg, data_hash):
 
 # -----------------------------------------------------------------------------
 def human_read_to_byte(size):
-    size_name = ("B", "KB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB")
     size = size.split()  # divide '1 GB' into ['1', 'GB']
-    if len(size) != 2 or int(size[0]) <= 0:
+    if len(size) != 2:
         raise ValueError("Invalid size")
-    num, unit = int(size[0]), size[1].upper()
-    try:
-        idx = size_name.index(unit)
-    except ValueError:
+    num = int(size[0])
+    shift = _UNIT_SHIFT.get(size[1].upper())
+    if num <= 0 or shift is None:
         raise ValueError("Invalid size")
-    factor = 1024 ** idx
-    return num * factor
+    return num << shift
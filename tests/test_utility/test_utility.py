@@ -13,16 +13,22 @@
 # limitations under the License.
 # ------------------------------------------------------------------------------
 
+import base64
 import unittest
+import utility._aes_backend as aes_backend
 from utility.utility import (
     create_error_response,
     strip_begin_end_key,
     list_difference,
+    compute_data_hash,
     encrypt_data,
+    make_encryptor,
     decrypt_data,
     decrypted_response,
     verify_data_hash,
     human_read_to_byte,
+    generate_key,
+    generate_iv,
 )
 
 
@@ -86,6 +92,205 @@ class UtilityTest(unittest.TestCase):
         list2 = []
         self.assertEquals(expected, list_difference(list1, list2))
 
+        expected = [3, 1, 3]                # Order and duplicates kept
+        list1 = [3, 2, 1, 3]
+        list2 = [2]
+        self.assertEquals(expected, list_difference(list1, list2))
+
+        expected = [{"id": 1}]              # Unhashable items
+        list1 = [{"id": 1}, {"id": 2}]
+        list2 = [{"id": 2}]
+        self.assertEquals(expected, list_difference(list1, list2))
+
+    def test_generate_key_iv(self):
+        """Tests to verify generate_key() and generate_iv() functions
+        """
+        # AES-GCM-256 key and IV lengths of tcf::crypto::skenc
+        self.assertEquals(32, len(generate_key()))
+        self.assertEquals(12, len(generate_iv()))
+        self.assertNotEquals(bytes(generate_key()), bytes(generate_key()))
+        self.assertNotEquals(bytes(generate_iv()), bytes(generate_iv()))
+
+    def test_encrypt_data(self):
+        """Tests to verify encrypt_data(data, encryption_key, iv) function
+        """
+        # AES-GCM-256 known answer (NIST GCM test case 15), output is
+        # ciphertext followed by the 16 byte tag as in tcf::crypto::skenc
+        key = bytes.fromhex("feffe9928665731c6d6a8f9467308308"
+            "feffe9928665731c6d6a8f9467308308")
+        iv = bytes.fromhex("cafebabefacedbaddecaf888")
+        msg = bytes.fromhex("d9313225f88406e5a55909c5aff5269a"
+            "86a7a9531534f7da2e4c303d8a318a721c3c0c95956809532fcf0e24"
+            "49a6b525b16aedf5aa0de657ba637b391aafd255")
+        expected = bytes.fromhex("522dc1f099567d07f47f37a32a84427d"
+            "643a8cdcbfe5c0c97598a2bd2555d1aa8cb08e48590dbb3da7b08b10"
+            "56828838c5f61e6393ba7a0abcc9f662898015ad"
+            "b094dac5d93471bdec1a502270e3cc6c")
+        self.assertEquals(expected, bytes(encrypt_data(msg, key, iv)))
+
+        # Random 12 byte IV prepended when no iv is given
+        encrypted = bytes(encrypt_data(msg, key))
+        self.assertEquals(len(msg) + 12 + 16, len(encrypted))
+        self.assertNotEquals(encrypted, bytes(encrypt_data(msg, key)))
+
+        self.assertRaises(ValueError, encrypt_data, msg, key[:16], iv)
+        self.assertRaises(ValueError, encrypt_data, msg, key, iv + iv[:4])
+
+    def test_make_encryptor(self):
+        """Tests to verify make_encryptor(encryption_key, iv) function
+        """
+        key = generate_key()
+        iv = generate_iv()
+        msg = b"work order data"
+
+        encrypt = make_encryptor(key, iv)
+        expected = bytes(encrypt_data(msg, key, iv))
+        self.assertEquals(expected, bytes(encrypt(msg)))
+        self.assertEquals(expected, bytes(encrypt(msg)))
+
+        # A new random IV is drawn for every message when iv is None
+        encrypt = make_encryptor(key)
+        encrypted = bytes(encrypt(msg))
+        self.assertEquals(len(msg) + 12 + 16, len(encrypted))
+        self.assertNotEquals(encrypted[:12], bytes(encrypt(msg))[:12])
+        self.assertEquals(msg.decode("UTF-8"), decrypt_data(
+            key, base64.b64encode(encrypted).decode("UTF-8")))
+
+    @unittest.skipUnless(aes_backend.USE_PYCA, "PyCA cryptography not used")
+    def test_aes_backend_bytes_only(self):
+        """Tests that only bytes are passed to PyCA AESGCM, as cryptography
+        releases before 41 reject other buffer types
+        """
+        passed_types = []
+        pyca_aesgcm = aes_backend.AESGCM
+
+        class StrictAESGCM(object):
+            def __init__(self, key):
+                passed_types.append(type(key))
+                self.aesgcm = pyca_aesgcm(key)
+
+            def encrypt(self, nonce, data, associated_data):
+                passed_types.extend((type(nonce), type(data)))
+                return self.aesgcm.encrypt(nonce, data, associated_data)
+
+            def decrypt(self, nonce, data, associated_data):
+                passed_types.extend((type(nonce), type(data)))
+                return self.aesgcm.decrypt(nonce, data, associated_data)
+
+        key = generate_key()
+        iv = generate_iv()
+        msg = "work order data"
+        aes_backend.AESGCM = StrictAESGCM
+        try:
+            for encrypt_iv in (iv, None):
+                encrypted = encrypt_data(
+                    bytearray(msg.encode("UTF-8")), key, encrypt_iv)
+                self.assertEquals(msg, decrypt_data(key, base64.b64encode(
+                    bytes(encrypted)).decode("UTF-8"), encrypt_iv))
+                self.assertEquals(msg.encode("UTF-8"),
+                    aes_backend.decrypt_message(
+                        key, memoryview(bytes(encrypted)), encrypt_iv))
+        finally:
+            aes_backend.AESGCM = pyca_aesgcm
+        self.assertTrue(passed_types)
+        self.assertEquals({bytes}, set(passed_types))
+
+    def test_decrypt_data(self):
+        """Tests to verify decrypt_data(encryption_key, data, iv) function
+        """
+        key = generate_key()
+        iv = generate_iv()
+        msg = "work order data"
+
+        def b64(encrypted):
+            return base64.b64encode(bytes(encrypted)).decode("UTF-8")
+
+        encrypted = b64(encrypt_data(msg.encode("UTF-8"), key, iv))
+        self.assertEquals(msg, decrypt_data(key, encrypted, iv))
+        encrypted = b64(encrypt_data(msg.encode("UTF-8"), key))
+        self.assertEquals(msg, decrypt_data(key, encrypted))
+        self.assertEquals("", decrypt_data(key, "", iv))
+
+        tampered = bytearray(encrypt_data(msg.encode("UTF-8"), key, iv))
+        tampered[0] ^= 1
+        self.assertRaises(ValueError, decrypt_data, key, b64(tampered), iv)
+        encrypted = b64(encrypt_data(msg.encode("UTF-8"), key, iv))
+        self.assertRaises(ValueError, decrypt_data, generate_key(),
+            encrypted, iv)
+
+        truncated = b64(bytes(encrypt_data(msg.encode("UTF-8"), key))[:20])
+        self.assertRaises(ValueError, decrypt_data, key, truncated)
+
+        self.assertRaises(ValueError, decrypt_data, bytes(key)[:16],
+            encrypted, iv)
+        self.assertRaises(ValueError, decrypt_data, key, encrypted,
+            bytes(iv)[:8])
+
+    def test_compute_data_hash(self):
+        """Tests to verify compute_data_hash(data) function
+        """
+        expected = bytes.fromhex(
+            "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad")
+        self.assertEquals(expected, compute_data_hash("abc"))
+        self.assertEquals(expected, compute_data_hash(b"abc"))
+        self.assertEquals(expected, compute_data_hash(bytearray(b"abc")))
+        self.assertEquals(expected, compute_data_hash(memoryview(b"abc")))
+
+        expected = compute_data_hash("\u00e9" * 100000)
+        self.assertEquals(expected,
+            compute_data_hash(("\u00e9" * 100000).encode("UTF-8")))
+
+        data = "\u00e9" * 60000                           # Chunked hashing
+        expected = compute_data_hash(data.encode("UTF-8"))
+        self.assertEquals(expected, compute_data_hash(data, chunk=4096))
+        self.assertEquals(expected, compute_data_hash(data, chunk=100000))
+        self.assertEquals(compute_data_hash("abc"),
+            compute_data_hash("abc", chunk=1))
+        self.assertRaises(ValueError, compute_data_hash, "abc", 0)
+
+    def test_verify_data_hash(self):
+        """Tests to verify verify_data_hash(msg, data_hash) function
+        """
+        data_hash = \
+            "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"
+        self.assertTrue(verify_data_hash("abc", data_hash))
+        self.assertTrue(verify_data_hash("abc", data_hash.upper()))
+        self.assertFalse(verify_data_hash("abd", data_hash))
+        self.assertFalse(verify_data_hash("abc", data_hash[:-2]))
+        self.assertFalse(verify_data_hash("abc", "not a hex string"))
+        # Whitespace is not accepted in the hex digest
+        spaced = " ".join(data_hash[i:i + 2] for i in range(0, 64, 2))
+        self.assertFalse(verify_data_hash("abc", spaced))
+        self.assertFalse(verify_data_hash("abc", " " + data_hash))
+        self.assertFalse(verify_data_hash("abc", data_hash[:62] + " f"))
+
+    def test_decrypted_response(self):
+        """Tests to verify decrypted_response(input_json, session_key,
+        session_iv) function
+        """
+        session_key = generate_key()
+        session_iv = generate_iv()
+        plain = base64.b64encode(b"plain data").decode("UTF-8")
+        encrypted = base64.b64encode(bytes(encrypt_data(
+            b"encrypted data", session_key, session_iv))).decode("UTF-8")
+        response = {"result": {"outData": [
+            {"data": plain, "iv": "", "encryptedDataEncryptionKey": "-"},
+            {"data": encrypted, "iv": "", "encryptedDataEncryptionKey": ""},
+            {"data": encrypted, "iv": "", "encryptedDataEncryptionKey": "null"},
+        ]}}
+        # Plain items must not disable decryption of the following items
+        out_data = decrypted_response(response, session_key, session_iv)
+        self.assertEquals(plain.encode("UTF-8"), out_data[0]["data"])
+        self.assertEquals("encrypted data", out_data[1]["data"])
+        self.assertEquals("encrypted data", out_data[2]["data"])
+
+        # Empty data needs no key, even if the data key is not given
+        response = {"result": {"outData": [
+            {"data": "", "iv": "", "encryptedDataEncryptionKey": "key"},
+        ]}}
+        out_data = decrypted_response(response, session_key, session_iv)
+        self.assertEquals("", out_data[0]["data"])
+
     def test_human_read_to_byte(self):
         """Tests to verify human_read_to_byte(size) function
         """
@@ -104,3 +309,11 @@ class UtilityTest(unittest.TestCase):
         self.assertEquals(expected, human_read_to_byte("10 kb"))
 
         self.assertRaises(Exception, human_read_to_byte, "1 MD")
+
+        expected = 3 * 1024 ** 3
+        self.assertEquals(expected, human_read_to_byte("3 GB"))
+
+        expected = 7
+        self.assertEquals(expected, human_read_to_byte("7 B"))
+
+        self.assertRaises(ValueError, human_read_to_byte, "0 KB")